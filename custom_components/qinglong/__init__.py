@@ -1,15 +1,18 @@
 """The QingLong integration."""
 
 from __future__ import annotations
+import asyncio
 import logging
 import time
+from datetime import timedelta
 import aiohttp
-import async_timeout
 from typing import Any
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util.json import json_loads
 
 from .const import (
     DOMAIN, 
@@ -24,19 +27,42 @@ from .const import (
     CONF_HOST,
     CONF_PORT,
     TOKEN_REFRESH_THRESHOLD,
-    TOKEN_EXPIRY_BUFFER,
+    SCAN_INTERVAL,
+    MAX_SCAN_INTERVAL,
+    TIME_FMT,
+    RUN_TASK_ATTEMPTS,
+    RUN_TASK_RETRY_STATUSES,
+    PLATFORMS,
 )
+from .models import TasksView
 
 _LOGGER = logging.getLogger(__name__)
 
-PLATFORMS = [Platform.SENSOR, Platform.SELECT]
-
 
 class QingLongClient:
     """Client to interact with QingLong API."""
     
+    __slots__ = (
+        "_host",
+        "_port",
+        "_ssl",
+        "_token",
+        "_token_expires",
+        "_client_id",
+        "_client_secret",
+        "_hass",
+        "_entry",
+        "_base_url",
+        "_headers",
+        "_refresh_lock",
+        "_last_refresh_time",
+        "_expires_at_cache",
+        "_expired_logged",
+    )
+    
     def __init__(self, host: str, port: int, ssl: bool, token: str, token_expires: int,
-                 client_id: str, client_secret: str, hass: HomeAssistant):
+                 client_id: str, client_secret: str, hass: HomeAssistant,
+                 entry: ConfigEntry):
         """Initialize the client."""
         self._host = host
         self._port = port
@@ -46,55 +72,75 @@ class QingLongClient:
         self._client_id = client_id
         self._client_secret = client_secret
         self._hass = hass
-        self._session = None
+        self._entry = entry
         self._base_url = f"{'https' if ssl else 'http'}://{host}:{port}"
-        self._refresh_lock = False
-        self._last_refresh_time = 0
+        # 请求头只在token变化时更新
+        self._headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        self._refresh_lock = asyncio.Lock()
+        self._last_refresh_time = 0  # 仅用于状态展示
+        self._expires_at_cache: tuple[int, str] = (-1, "")  # (过期时间戳, 格式化字符串)
+        self._expired_logged = False
+    
+    @property
+    def token(self) -> str:
+        """Return the current token."""
+        return self._token
     
-    async def _get_session(self) -> aiohttp.ClientSession:
-        """Get or create a session."""
-        if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession()
-        return self._session
+    @property
+    def token_expires(self) -> int:
+        """Return the token expiry as a Unix timestamp."""
+        return self._token_expires
+    
+    @property
+    def last_refresh_time(self) -> int:
+        """Return when the token was last refreshed, 0 if never."""
+        return self._last_refresh_time
     
     async def _refresh_token_if_needed(self) -> bool:
         """Refresh token if expired or about to expire."""
-        current_time = int(time.time())
-        
         # 如果token还有效期超过阈值，不需要刷新
-        if self._token_expires - current_time > TOKEN_REFRESH_THRESHOLD:
+        if self._token_expires - int(time.time()) > TOKEN_REFRESH_THRESHOLD:
             return True
         
-        # 防止同时多个刷新请求
-        if self._refresh_lock:
-            _LOGGER.debug("Token refresh already in progress")
-            return False
-        
-        # 防止过于频繁的刷新尝试（至少间隔5分钟）
-        if current_time - self._last_refresh_time < 300:
-            _LOGGER.debug("Token refresh too recent, skipping")
+        # 串行化刷新：同一时刻只有一个协程发起认证请求，其余等待后复用新token
+        # 总耗时（含等待锁）限制在15秒内，避免卡住轮询
+        try:
+            async with asyncio.timeout(15):
+                async with self._refresh_lock:
+                    return await self._async_refresh_token()
+        except asyncio.TimeoutError:
+            _LOGGER.error("Timed out refreshing token")
             return False
-            
-        self._refresh_lock = True
+    
+    async def _async_refresh_token(self) -> bool:
+        """Request a new token; the caller must hold the refresh lock."""
+        current_time = int(time.time())
+        if self._token_expires - current_time > TOKEN_REFRESH_THRESHOLD:
+            _LOGGER.debug("Token already refreshed by another caller")
+            return True
         
         try:
             _LOGGER.info("Refreshing QingLong token (expires in %d seconds)", 
                         self._token_expires - current_time)
             
-            session = await self._get_session()
             url = f"{self._base_url}{API_AUTH}"
             params = {
                 "client_id": self._client_id,
                 "client_secret": self._client_secret
             }
             
-            async with async_timeout.timeout(10):
+            session = async_get_clientsession(self._hass)
+            async with asyncio.timeout(10):
                 async with session.get(url, params=params) as response:
                     if response.status != 200:
                         _LOGGER.error("Failed to refresh token: HTTP %s", response.status)
                         return False
                     
-                    data = await response.json()
+                    # 部分面板的Content-Type不标准，与配置流程一样不做校验
+                    data = json_loads(await response.read())
                     if data.get("code") != 200:
                         _LOGGER.error("Failed to refresh token: %s", data.get("message"))
                         return False
@@ -110,7 +156,7 @@ class QingLongClient:
                     if expiration and expiration > current_time:
                         self._token_expires = int(expiration)
                         _LOGGER.info("New token expires at: %s (in %d days)", 
-                                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self._token_expires)),
+                                    time.strftime(TIME_FMT, time.localtime(self._token_expires)),
                                     (self._token_expires - current_time) // 86400)
                     else:
                         # 默认30天有效期
@@ -118,16 +164,26 @@ class QingLongClient:
                         _LOGGER.warning("No valid expiration in response, using default 30 days")
                     
                     self._token = new_token
+                    self._headers["Authorization"] = f"Bearer {new_token}"
                     self._last_refresh_time = current_time
                     
+                    # 写回配置条目，重启后无需立即重新认证（时钟回拨时不覆盖）
+                    if self._token_expires >= self._entry.data.get(CONF_TOKEN_EXPIRES, 0):
+                        self._hass.config_entries.async_update_entry(
+                            self._entry,
+                            data={
+                                **self._entry.data,
+                                CONF_TOKEN: self._token,
+                                CONF_TOKEN_EXPIRES: self._token_expires,
+                            },
+                        )
+                    
                     _LOGGER.info("Token refreshed successfully")
                     return True
                     
         except Exception as err:
             _LOGGER.error("Error refreshing token: %s", err)
             return False
-        finally:
-            self._refresh_lock = False
     
     async def async_run_task(self, task_id: str):
         """Run a specific task."""
@@ -135,116 +191,178 @@ class QingLongClient:
             # 先检查并刷新token
             await self._refresh_token_if_needed()
             
-            session = await self._get_session()
-            url = f"{self._base_url}{API_CRONS_RUN}"
+            # token已过期且刷新失败，请求必然401，直接放弃
+            if self._token_expires <= int(time.time()):
+                _LOGGER.error("Cannot run task %s: token expired and refresh failed", task_id)
+                return False
             
-            headers = {
-                "Authorization": f"Bearer {self._token}",
-                "Content-Type": "application/json"
-            }
+            url = f"{self._base_url}{API_CRONS_RUN}"
             
             # 根据API文档，请求体应该是包含任务ID的数组
-            data = [task_id]
+            # 任务ID为数字字符串，直接拼出JSON，无需经过json序列化
+            data = f'["{task_id}"]'.encode()
             
-            async with async_timeout.timeout(10):
-                async with session.put(url, headers=headers, json=data) as response:
-                    if response.status == 401:
-                        # Token无效，尝试强制刷新
-                        _LOGGER.warning("Token invalid, forcing refresh")
-                        self._last_refresh_time = 0
-                        return False
-                    
-                    if response.status != 200:
-                        _LOGGER.error("Failed to run task: HTTP %s", response.status)
-                        return False
-                    
-                    result = await response.json()
-                    if result.get("code") != 200:
-                        _LOGGER.error("Failed to run task: %s", result.get("message"))
-                        return False
-                    
-                    _LOGGER.info("Task %s started successfully", task_id)
-                    return True
+            # 运行任务的PUT不是幂等的，只在确定面板没有处理请求时指数退避后重试：
+            # 连接未建立（请求尚未发出），或网关返回502/503/504。
+            # 等待响应超时或面板自身的5xx无法确定任务是否已启动，不重发
+            for attempt in range(1, RUN_TASK_ATTEMPTS + 1):
+                try:
+                    return await self._async_put_run(task_id, url, data)
+                except (aiohttp.ClientConnectorError, aiohttp.ClientResponseError) as err:
+                    if attempt == RUN_TASK_ATTEMPTS:
+                        raise
+                    delay = min(0.5 * 2 ** (attempt - 1), 4)
+                    _LOGGER.warning("Failed to run task %s (%s), retrying in %.1f seconds",
+                                    task_id, err, delay)
+                    await asyncio.sleep(delay)
                     
+        except TimeoutError:
+            _LOGGER.error("Timed out running task %s", task_id)
+            return False
         except Exception as err:
             _LOGGER.error("Error running task: %s", err)
             return False
     
-    def get_token_info(self) -> dict:
-        """Get token information for sensor."""
-        current_time = int(time.time())
-        expires_in = self._token_expires - current_time
+    async def _async_put_run(self, task_id: str, url: str, data: bytes) -> bool:
+        """Send one run request; raise only on errors worth retrying."""
+        session = async_get_clientsession(self._hass)
+        async with asyncio.timeout(10):
+            response = await session.put(url, headers=self._headers, data=data)
         
-        # 计算剩余天数/小时/分钟
-        if expires_in > 0:
-            days = expires_in // 86400
-            hours = (expires_in % 86400) // 3600
-            minutes = (expires_in % 3600) // 60
-            seconds = expires_in % 60
+        async with response:
+            if response.status == 401:
+                # Token无效，下次调用时强制刷新
+                _LOGGER.warning("Token invalid, forcing refresh")
+                self._token_expires = 0
+                return False
+            
+            if response.status in RUN_TASK_RETRY_STATUSES:
+                # 网关错误，抛出ClientResponseError交给调用方重试
+                response.raise_for_status()
+            
+            if response.status != 200:
+                _LOGGER.error("Failed to run task: HTTP %s", response.status)
+                return False
             
-            if days > 0:
-                expires_display = f"{days}天{hours}小时"
-            elif hours > 0:
-                expires_display = f"{hours}小时{minutes}分钟"
-            elif minutes > 0:
-                expires_display = f"{minutes}分钟{seconds}秒"
-            else:
-                expires_display = f"{seconds}秒"
-        else:
-            expires_display = "已过期"
+            # 面板已接受请求，读取响应体出错也不能重试；部分面板的Content-Type不标准，不做校验
+            try:
+                async with asyncio.timeout(10):
+                    result = json_loads(await response.read())
+            except (aiohttp.ClientError, TimeoutError, ValueError) as err:
+                _LOGGER.error("Task %s was sent but the response could not be read: %s", task_id, err)
+                return False
+            
+            if result.get("code") != 200:
+                _LOGGER.error("Failed to run task: %s", result.get("message"))
+                return False
+            
+            _LOGGER.info("Task %s started successfully", task_id)
+            return True
+    
+    @property
+    def expires_at_display(self) -> str:
+        """Format the token expiry, reformatting only when it changes."""
+        if self._expires_at_cache[0] != self._token_expires:
+            display = time.strftime(TIME_FMT, time.localtime(self._token_expires)) if self._token_expires > 0 else "已过期"
+            self._expires_at_cache = (self._token_expires, display)
+        return self._expires_at_cache[1]
+    
+    @staticmethod
+    def format_expires_in(expires_in: int) -> str:
+        """Format the remaining token lifetime for display."""
+        if expires_in <= 0:
+            return "已过期"
+        
+        # 计算剩余天数/小时/分钟，按最高的非零单位选择显示格式
+        days, rest = divmod(expires_in, 86400)
+        hours, rest = divmod(rest, 3600)
+        minutes, seconds = divmod(rest, 60)
+        if days:
+            return f"{days}天{hours}小时"
+        if hours:
+            return f"{hours}小时{minutes}分钟"
+        if minutes:
+            return f"{minutes}分钟{seconds}秒"
+        return f"{seconds}秒"
+    
+    @staticmethod
+    def _parse_tasks(raw: Any) -> TasksView:
+        """Unwrap the API response and precompute what the entities need."""
+        tasks_list = []
+        if isinstance(raw, dict) and "data" in raw:
+            inner_data = raw["data"]
+            if isinstance(inner_data, dict) and "data" in inner_data:
+                # Structure: {"data": {"data": [...], "total": 2}}
+                tasks_list = inner_data.get("data", [])
+            elif isinstance(inner_data, list):
+                # Direct list
+                tasks_list = inner_data
         
-        return {
-            "token": self._token,  # 返回完整token，而不是截断的
-            "token_expires": self._token_expires,
-            "expires_in": expires_in,
-            "expires_display": expires_display,
-            "expires_at": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self._token_expires)) if self._token_expires > 0 else "已过期",
-            "is_valid": expires_in > TOKEN_EXPIRY_BUFFER,
-            "needs_refresh": expires_in <= TOKEN_REFRESH_THRESHOLD,
-            "last_refresh_time": self._last_refresh_time,
+        tasks = [task for task in tasks_list if isinstance(task, dict)]
+        commands = [task.get("command", "") for task in tasks]
+        
+        # 统计启用/禁用的任务
+        disabled_count = sum(1 for task in tasks if task.get("isDisabled"))
+        
+        # 只有明确启用的任务 (isDisabled: 0) 才能被选择运行，
+        # 以去掉"task "前缀的脚本名称作为选项
+        name_to_info = {
+            command.removeprefix("task "): {
+                "task_id": str(task.get("id")),
+                "command": command,
+                "name": task.get("name", "未命名任务"),
+            }
+            for task, command in zip(tasks, commands)
+            if task.get("isDisabled") == 0
         }
+        
+        return TasksView(
+            tasks_list=tasks_list,
+            enabled_count=len(commands) - disabled_count,
+            disabled_count=disabled_count,
+            commands=commands,
+            name_to_info=name_to_info,
+        )
     
-    async def async_get_tasks(self):
+    async def async_get_tasks(self) -> TasksView | None:
         """Get all tasks from QingLong."""
         try:
             # 先检查并刷新token
             await self._refresh_token_if_needed()
             
-            session = await self._get_session()
-            url = f"{self._base_url}{API_CRONS}"
+            # token已过期且刷新失败，请求必然401，直接按失败处理
+            if self._token_expires <= int(time.time()):
+                if not self._expired_logged:
+                    _LOGGER.warning("Token expired and refresh failed, skipping task fetch")
+                    self._expired_logged = True
+                return None
+            self._expired_logged = False
             
-            headers = {
-                "Authorization": f"Bearer {self._token}",
-                "Content-Type": "application/json"
-            }
+            url = f"{self._base_url}{API_CRONS}"
             
-            async with async_timeout.timeout(10):
-                async with session.get(url, headers=headers) as response:
+            session = async_get_clientsession(self._hass)
+            async with asyncio.timeout(10):
+                async with session.get(url, headers=self._headers) as response:
                     if response.status == 401:
-                        # Token无效，尝试强制刷新
+                        # Token无效，下次调用时强制刷新
                         _LOGGER.warning("Token invalid, forcing refresh")
-                        self._last_refresh_time = 0
-                        return {}
+                        self._token_expires = 0
+                        return None
                     
                     if response.status != 200:
                         _LOGGER.error("Failed to get tasks: HTTP %s", response.status)
-                        return {}
+                        return None
                     
-                    data = await response.json()
+                    data = json_loads(await response.read())
                     if data.get("code") != 200:
                         _LOGGER.error("Failed to get tasks: %s", data.get("message"))
-                        return {}
+                        return None
                     
-                    return data
+                    return self._parse_tasks(data)
                     
         except Exception as err:
             _LOGGER.error("Error getting tasks: %s", err)
-            return {}
-    
-    async def async_close(self):
-        """Close the client session."""
-        if self._session and not self._session.closed:
-            await self._session.close()
+            return None
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
@@ -259,17 +377,46 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     client_secret = entry.data.get(CONF_CLIENT_SECRET)
     
     # Create client
-    client = QingLongClient(host, port, ssl, token, token_expires, client_id, client_secret, hass)
+    client = QingLongClient(host, port, ssl, token, token_expires, client_id, client_secret, hass, entry)
+    
+    def _set_update_interval(interval: timedelta) -> None:
+        """Change the poll interval, logging only actual changes."""
+        if coordinator.update_interval != interval:
+            _LOGGER.debug("Changing QingLong poll interval to %s", interval)
+            coordinator.update_interval = interval
+    
+    def _back_off() -> None:
+        """Double the poll interval after a failed update."""
+        _set_update_interval(min(coordinator.update_interval * 2, MAX_SCAN_INTERVAL))
     
-    # Test connection and get initial data
-    tasks_data = {}
-    if token:
+    async def _async_update_data():
+        """Fetch tasks, giving up before the next poll is due."""
         try:
-            tasks_data = await client.async_get_tasks()
-            if tasks_data:
-                _LOGGER.info("Successfully connected to QingLong panel")
-        except Exception as err:
-            _LOGGER.error("Failed to get initial data: %s", err)
+            async with asyncio.timeout(25):
+                tasks = await client.async_get_tasks()
+        except TimeoutError:
+            _back_off()
+            raise
+        
+        # 面板不可达时拉长轮询间隔，恢复后立即回到默认值；
+        # 抛出UpdateFailed让coordinator保留上次成功的数据
+        if tasks is None:
+            _back_off()
+            raise UpdateFailed("Failed to fetch tasks from QingLong")
+        _set_update_interval(SCAN_INTERVAL)
+        return tasks
+    
+    # 统一轮询：所有实体共享同一份任务数据，每个周期只请求一次API
+    coordinator = DataUpdateCoordinator(
+        hass,
+        _LOGGER,
+        name=DOMAIN,
+        update_interval=SCAN_INTERVAL,
+        update_method=_async_update_data,
+    )
+    await coordinator.async_config_entry_first_refresh()
+    if coordinator.data:
+        _LOGGER.info("Successfully connected to QingLong panel")
     
     # Store data
     hass.data.setdefault(DOMAIN, {})
@@ -280,7 +427,14 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         "token": token,
         "token_expires": token_expires,
         "client": client,
-        "tasks": tasks_data,
+        "coordinator": coordinator,
+        # 所有实体共享同一个设备信息
+        "device_info": {
+            "identifiers": {(DOMAIN, entry.entry_id)},
+            "name": f"青龙面板 ({host}:{port})",
+            "manufacturer": "青龙面板",
+            "model": "QingLong",
+        },
         "selected_task": None,  # 存储用户选择的任务
     }
     
@@ -292,11 +446,8 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
-    # Close client session
+    # 会话由Home Assistant统一管理，无需手动关闭
     if DOMAIN in hass.data and entry.entry_id in hass.data[DOMAIN]:
-        client = hass.data[DOMAIN][entry.entry_id].get("client")
-        if client:
-            await client.async_close()
         hass.data[DOMAIN].pop(entry.entry_id)
     
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
@@ -1,18 +1,18 @@
 """Config flow for QingLong integration."""
 
 from __future__ import annotations
+import functools
 import logging
 from typing import Any
-import voluptuous as vol
 
 from homeassistant import config_entries
 from homeassistant.core import HomeAssistant
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.const import CONF_HOST, CONF_PORT
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.util.json import json_loads
 import aiohttp
-import async_timeout
-import json
 
 from .const import (
     DOMAIN,
@@ -26,15 +26,25 @@ from .const import (
 
 _LOGGER = logging.getLogger(__name__)
 
-STEP_USER_DATA_SCHEMA = vol.Schema(
-    {
-        vol.Required(CONF_HOST, default="localhost"): str,
-        vol.Required(CONF_PORT, default=DEFAULT_PORT): int,
-        vol.Required(CONF_CLIENT_ID): str,
-        vol.Required(CONF_CLIENT_SECRET): str,
-        vol.Optional(CONF_SSL, default=DEFAULT_SSL): bool,
-    }
-)
+# 按套接字实际耗时计时，事件循环短暂阻塞不会导致误超时
+VALIDATE_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=3, sock_read=5)
+
+
+@functools.lru_cache(maxsize=1)
+def _user_data_schema():
+    """Build the user step schema on first use."""
+    # 仅在用户发起配置时才需要，延迟导入voluptuous
+    import voluptuous as vol
+    
+    return vol.Schema(
+        {
+            vol.Required(CONF_HOST, default="localhost"): str,
+            vol.Required(CONF_PORT, default=DEFAULT_PORT): int,
+            vol.Required(CONF_CLIENT_ID): str,
+            vol.Required(CONF_CLIENT_SECRET): str,
+            vol.Optional(CONF_SSL, default=DEFAULT_SSL): bool,
+        }
+    )
 
 
 async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str, Any]:
@@ -52,28 +62,31 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
         "client_secret": client_secret
     }
     
-    async with aiohttp.ClientSession() as session:
-        async with async_timeout.timeout(10):
-            async with session.get(url, params=params) as response:
-                if response.status != 200:
-                    raise CannotConnect(f"HTTP status: {response.status}")
-                
-                data_response = await response.json()
-                if data_response.get("code") != 200:
-                    raise InvalidAuth(data_response.get("message", "Authentication failed"))
-                
-                token = data_response.get("data", {}).get("token")
-                if not token:
-                    raise InvalidAuth("No token in response")
-                
-                # Store the validated data
-                result = {
-                    "title": f"青龙面板 ({host}:{port})",
-                    "data": data.copy(),
-                    "token": token
-                }
-                
-                return result
+    session = async_get_clientsession(hass)
+    try:
+        async with session.get(
+            url, params=params, timeout=VALIDATE_TIMEOUT, raise_for_status=True
+        ) as response:
+            # 不校验content-type，直接用HA内置的orjson解析
+            data_response = json_loads(await response.read())
+    except aiohttp.ClientResponseError as err:
+        # 错误响应的body不会被读取
+        raise CannotConnect(f"HTTP status: {err.status}") from err
+    
+    if data_response.get("code") != 200:
+        raise InvalidAuth(data_response.get("message", "Authentication failed"))
+    
+    token = data_response.get("data", {}).get("token")
+    if not token:
+        raise InvalidAuth("No token in response")
+    
+    # Store the validated data
+    result = {
+        "title": f"青龙面板 ({host}:{port})",
+        "token": token
+    }
+    
+    return result
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -88,6 +101,17 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         errors: dict[str, str] = {}
         
         if user_input is not None:
+            # 同一面板和client_id只允许配置一次，在发起网络请求前就中止
+            self._async_abort_entries_match({
+                CONF_HOST: user_input[CONF_HOST],
+                CONF_PORT: user_input[CONF_PORT],
+                CONF_CLIENT_ID: user_input[CONF_CLIENT_ID],
+            })
+            await self.async_set_unique_id(
+                f"{user_input[CONF_HOST]}:{user_input[CONF_PORT]}:{user_input[CONF_CLIENT_ID]}"
+            )
+            self._abort_if_unique_id_configured()
+            
             try:
                 info = await validate_input(self.hass, user_input)
             except CannotConnect:
@@ -108,7 +132,7 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
         return self.async_show_form(
             step_id="user",
-            data_schema=STEP_USER_DATA_SCHEMA,
+            data_schema=_user_data_schema(),
             errors=errors
         )
 
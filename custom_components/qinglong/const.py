@@ -1,5 +1,9 @@
 """Constants for QingLong integration."""
 
+from datetime import timedelta
+
+from homeassistant.const import Platform
+
 DOMAIN = "qinglong"
 
 # Configuration
@@ -20,9 +24,22 @@ API_AUTH = "/open/auth/token"
 API_CRONS = "/open/crons"
 API_CRONS_RUN = "/open/crons/run"
 
+# 运行任务遇到临时故障时的最大尝试次数
+RUN_TASK_ATTEMPTS = 3
+
+# 网关返回的这些状态码说明请求未到达面板，可以安全重试
+RUN_TASK_RETRY_STATUSES = frozenset({502, 503, 504})
+
+# 显示时间格式
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
 # Token refresh settings - 提前1天刷新token
 TOKEN_REFRESH_THRESHOLD = 86400  # 提前1天刷新token (24小时)
 TOKEN_EXPIRY_BUFFER = 3600  # 1小时缓冲时间
 
+# 轮询间隔 - 30秒，面板不可达时指数退避，最长5分钟
+SCAN_INTERVAL = timedelta(seconds=30)
+MAX_SCAN_INTERVAL = timedelta(minutes=5)
+
 # Platforms
-PLATFORMS = ["sensor", "select"]
+PLATFORMS = (Platform.SENSOR, Platform.SELECT)
@@ -0,0 +1,37 @@
+"""Data models for QingLong integration."""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import NamedTuple
+
+
+class TasksView(NamedTuple):
+    """Task list parsed once per poll and shared by all entities."""
+    
+    tasks_list: list
+    enabled_count: int
+    disabled_count: int
+    commands: list[str]
+    name_to_info: dict[str, dict[str, str]]  # 脚本名 -> 已启用任务信息
+
+
+@dataclass(slots=True)
+class RunStatus:
+    """Status of the most recent task run."""
+    
+    task_name: str
+    status: str  # running / success / failed
+    start_time: float
+    end_time: float = 0.0  # 0表示尚未结束
+    result: str | None = None
+    error: str | None = None
+
+
+@dataclass(slots=True)
+class SelectedTask:
+    """Task most recently selected for running."""
+    
+    task_id: str
+    option: str = "未知任务"
+    timestamp: float = 0.0
+    run_status: RunStatus | None = None
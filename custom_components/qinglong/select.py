@@ -3,20 +3,24 @@
 from __future__ import annotations
 import logging
 import time
-from datetime import timedelta
 from typing import Any
 
 from homeassistant.components.select import SelectEntity
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import (
+    CoordinatorEntity,
+    DataUpdateCoordinator,
+)
 
-from .const import DOMAIN
+from .const import DOMAIN, TIME_FMT
+from .models import RunStatus, SelectedTask
 
 _LOGGER = logging.getLogger(__name__)
 
-# 轮询间隔 - 30秒
-SCAN_INTERVAL = timedelta(seconds=30)
+# 选中状态保留1分钟（纳秒，整数比较）
+SELECT_TIMEOUT_NS = 60_000_000_000
 
 
 async def async_setup_entry(
@@ -27,32 +31,47 @@ async def async_setup_entry(
     """Set up QingLong select entities from a config entry."""
     
     data = hass.data[DOMAIN][entry.entry_id]
-    client = data.get("client")
-    host = data.get("host")
-    port = data.get("port")
-    tasks_data = data.get("tasks", {})
+    coordinator = data["coordinator"]
     
     # Create select entity
-    select_entity = QingLongTaskSelect(entry, client, host, port, tasks_data)
-    async_add_entities([select_entity], True)
+    select_entity = QingLongTaskSelect(coordinator, entry, data)
+    async_add_entities([select_entity])
 
 
-class QingLongTaskSelect(SelectEntity):
+class QingLongTaskSelect(CoordinatorEntity[DataUpdateCoordinator], SelectEntity):
     """Representation of a QingLong task select."""
     
-    # 设置轮询间隔
-    _attr_should_poll = True
+    __slots__ = (
+        "_entry",
+        "_client",
+        "_host",
+        "_port",
+        "_select_time",
+        "_select_ns",
+        "_clear_select_timer",
+        "_task_mapping",
+        "_entry_data",
+        "_fmt_cache",
+        "_base_attrs",
+    )
     
-    def __init__(self, entry: ConfigEntry, client, host: str, port: int, tasks_data: dict):
+    # 由coordinator推送更新，无需单独轮询
+    _attr_should_poll = False
+    
+    def __init__(self, coordinator: DataUpdateCoordinator, entry: ConfigEntry,
+                 entry_data: dict[str, Any]):
         """Initialize the select."""
+        super().__init__(coordinator)
         self._entry = entry
-        self._client = client
-        self._host = host
-        self._port = port
-        self._tasks_data = tasks_data
-        self._last_update = 0
-        self._select_time = 0  # 记录选中时间
+        self._entry_data = entry_data  # hass.data[DOMAIN][entry.entry_id]
+        self._client = entry_data.get("client")
+        self._host = entry_data.get("host")
+        self._port = entry_data.get("port")
+        self._select_time = 0  # 记录选中时间（用于显示）
+        self._select_ns = 0  # 选中时的单调时钟，纳秒（用于超时判断）
         self._clear_select_timer = None  # 清除选中状态的定时器
+        self._fmt_cache: dict[float, str] = {}  # 时间戳 -> 格式化字符串
+        self._base_attrs = {"host": self._host, "port": self._port}  # 生命周期内不变的属性
         
         # Entity properties
         self._attr_name = "运行定时任务"
@@ -60,23 +79,16 @@ class QingLongTaskSelect(SelectEntity):
         self._attr_icon = "mdi:play"
         
         # Select properties
-        self._options = []
-        self._current_option = None
+        self._attr_options = []
+        self._attr_current_option = None
         self._task_mapping = {}  # 存储command到task_id的映射
         
         # Device info
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, entry.entry_id)},
-            "name": f"青龙面板 ({host}:{port})",
-            "manufacturer": "青龙面板",
-            "model": "QingLong",
-        }
-    
-    async def async_added_to_hass(self) -> None:
-        """Run when entity about to be added to hass."""
-        await super().async_added_to_hass()
-        # 现在self.hass已经可用，可以更新选项
-        await self.async_update()
+        self._attr_device_info = entry_data["device_info"]
+        
+        # 初始选项和属性
+        self._update_options()
+        self._update_attributes()
     
     def _update_options(self):
         """Update select options from tasks data."""
@@ -84,182 +96,131 @@ class QingLongTaskSelect(SelectEntity):
             _LOGGER.debug("Client not available, skipping options update")
             return
         
-        # 从hass.data获取最新的tasks_data
-        if DOMAIN in self.hass.data and self._entry.entry_id in self.hass.data[DOMAIN]:
-            tasks_data = self.hass.data[DOMAIN][self._entry.entry_id].get("tasks", {})
-        else:
-            tasks_data = self._tasks_data
-        
-        # 提取已启用的任务 (isDisabled: 0)
-        enabled_tasks = []
-        self._task_mapping = {}
-        
-        if isinstance(tasks_data, dict) and "data" in tasks_data:
-            inner_data = tasks_data["data"]
-            
-            # 获取任务数组
-            if isinstance(inner_data, dict) and "data" in inner_data:
-                tasks_list = inner_data.get("data", [])
-            elif isinstance(inner_data, list):
-                tasks_list = inner_data
-            else:
-                tasks_list = []
-            
-            for task in tasks_list:
-                if isinstance(task, dict) and task.get("isDisabled") == 0:
-                    task_id = str(task.get("id"))
-                    command = task.get("command", "")
-                    
-                    # 从command中提取脚本名称（去掉前面的"task "）
-                    if command.startswith("task "):
-                        script_name = command[5:]  # 去掉"task "前缀
-                    else:
-                        script_name = command
-                    
-                    enabled_tasks.append(script_name)
-                    self._task_mapping[script_name] = {
-                        "task_id": task_id,
-                        "command": command,
-                        "name": task.get("name", "未命名任务"),
-                    }
+        # 从coordinator获取已解析的任务 (isDisabled: 0)
+        tasks = self.coordinator.data
+        self._task_mapping = tasks.name_to_info if tasks else {}
         
         # 排序并设置选项
-        self._options = sorted(enabled_tasks)
-        self._attr_options = self._options
+        self._attr_options = sorted(self._task_mapping)
         
         # 不默认选中任何选项，移除以下代码：
-        # if not self._current_option and self._options:
-        #     self._current_option = self._options[0]
-        #     self._attr_current_option = self._current_option
+        # if not self._attr_current_option and self._attr_options:
+        #     self._attr_current_option = self._attr_options[0]
         
-        _LOGGER.debug("Updated options: %s", self._options)
+        _LOGGER.debug("Updated options: %s", self._attr_options)
     
-    async def _clear_selected_option(self):
-        """Clear the selected option after 1 minute."""
-        _LOGGER.debug("Clearing selected option after timeout")
-        self._current_option = None
+    def _clear_selected_option(self):
+        """Clear the selected option without writing state."""
+        _LOGGER.debug("Clearing selected option")
         self._attr_current_option = None
         self._select_time = 0
-        self.async_write_ha_state()
+        self._select_ns = 0
         
         # 清除存储的选择状态
-        if DOMAIN in self.hass.data and self._entry.entry_id in self.hass.data[DOMAIN]:
-            self.hass.data[DOMAIN][self._entry.entry_id]["selected_task"] = None
-    
-    @property
-    def options(self) -> list[str]:
-        """Return the available options."""
-        return self._attr_options
+        self._entry_data["selected_task"] = None
     
-    @property
-    def current_option(self) -> str | None:
-        """Return the current option."""
-        return self._attr_current_option
+    @callback
+    def _async_clear_selected_option_timeout(self):
+        """Clear the selected option after 1 minute."""
+        self._clear_selected_option()
+        self._update_attributes()
+        self.async_write_ha_state()
     
     async def async_select_option(self, option: str) -> None:
         """Select an option."""
-        if option not in self._options:
+        if option not in self._attr_options:
             raise ValueError(f"Invalid option: {option}")
         
-        self._current_option = option
+        # 墙上时间只读一次，选中时间、运行开始时间和选择记录共用，格式化缓存也能直接命中
+        now = time.time()
         self._attr_current_option = option
-        self._select_time = time.time()  # 记录选中时间
+        self._select_ns = time.monotonic_ns()
+        self._select_time = now  # 记录选中时间
+        
+        # 设置1分钟后清除选中状态的定时器
+        if self._clear_select_timer:
+            self._clear_select_timer.cancel()
         
-        # 运行状态跟踪
-        run_status = {
-            "task_name": option,
-            "status": "running",
-            "start_time": time.time(),
-            "result": None,
-            "error": None
-        }
+        # 在HA中创建定时器，1分钟后清除选中状态
+        self._clear_select_timer = self.hass.loop.call_later(
+            60,  # 60秒 = 1分钟
+            self._async_clear_selected_option_timeout
+        )
         
         # 运行选中的任务
+        # API调用放到后台执行，选择操作立即返回，不会因面板响应慢而阻塞界面；
+        # 代价是调用失败不会直接反馈给操作者，只体现在last_run_status属性中；
+        # 后台任务绑定到配置条目，卸载时随之取消
         if option in self._task_mapping:
-            task_info = self._task_mapping[option]
-            task_id = task_info["task_id"]
-            
-            _LOGGER.info("Running task: %s (ID: %s)", option, task_id)
+            task_id = self._task_mapping[option]["task_id"]
             
-            # 调用API运行任务
-            success = await self._client.async_run_task(task_id)
-            
-            run_status["end_time"] = time.time()
-            
-            if success:
-                _LOGGER.info("Task %s started successfully", option)
-                run_status["status"] = "success"
-                run_status["result"] = "任务已启动"
-            else:
-                _LOGGER.error("Failed to start task %s", option)
-                run_status["status"] = "failed"
-                run_status["error"] = "API调用失败"
+            # 运行状态跟踪
+            run_status = RunStatus(task_name=option, status="running", start_time=now)
             
             # 存储选择
-            self.hass.data[DOMAIN][self._entry.entry_id]["selected_task"] = {
-                "option": option,
-                "task_id": task_id,
-                "timestamp": time.time(),
-                "run_status": run_status
-            }
+            self._entry_data["selected_task"] = SelectedTask(
+                task_id=task_id,
+                option=option,
+                timestamp=now,
+                run_status=run_status,
+            )
+            
+            self._entry.async_create_background_task(
+                self.hass,
+                self._async_run_task(option, task_id, run_status),
+                name=f"qinglong_run_{task_id}",
+            )
         
-        # 设置1分钟后清除选中状态的定时器
-        if self._clear_select_timer:
-            self._clear_select_timer()
+        # 更新状态
+        self._update_attributes()
+        self.async_write_ha_state()
+    
+    async def _async_run_task(self, option: str, task_id: str, run_status: RunStatus) -> None:
+        """Run the selected task in the background and record the result."""
+        if _LOGGER.isEnabledFor(logging.INFO):
+            _LOGGER.info("Running task: %s (ID: %s)", option, task_id)
         
-        # 在HA中创建定时器，1分钟后清除选中状态
-        def _clear_timer_callback():
-            self.hass.async_create_task(self._clear_selected_option())
+        # 调用API运行任务
+        success = await self._client.async_run_task(task_id)
         
-        self._clear_select_timer = self.hass.loop.call_later(
-            60,  # 60秒 = 1分钟
-            _clear_timer_callback
-        )
+        run_status.end_time = time.time()
+        
+        if success:
+            if _LOGGER.isEnabledFor(logging.INFO):
+                _LOGGER.info("Task %s started successfully", option)
+            run_status.status = "success"
+            run_status.result = "任务已启动"
+        else:
+            _LOGGER.error("Failed to start task %s", option)
+            run_status.status = "failed"
+            run_status.error = "API调用失败"
         
         # 更新状态
+        self._update_attributes()
         self.async_write_ha_state()
     
-    async def async_update(self) -> None:
-        """Update select options."""
-        current_time = time.time()
-        
-        # 检查是否需要更新（避免过于频繁的API调用）
-        if current_time - self._last_update < 30:
-            # 检查是否应该清除选中状态（如果选中时间超过1分钟）
-            if self._current_option and self._select_time > 0:
-                if current_time - self._select_time > 60:
-                    await self._clear_selected_option()
-            return
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle updated data from the coordinator."""
+        if self.coordinator.data:
+            # 更新选项
+            self._update_options()
             
-        if self._client:
-            # 获取最新的任务数据
-            try:
-                new_tasks_data = await self._client.async_get_tasks()
-                self._last_update = current_time
-                
-                if new_tasks_data:
-                    # 更新存储的数据
-                    self.hass.data[DOMAIN][self._entry.entry_id]["tasks"] = new_tasks_data
-                    
-                    # 更新选项
-                    self._update_options()
-                    
-                    # 如果当前选项不在新选项中，清除选中状态
-                    if self._current_option and self._current_option not in self._options:
-                        await self._clear_selected_option()
-                            
-                    # 记录更新状态
-                    _LOGGER.debug("Task select updated with %d options", len(self._options))
-                    
-                # 检查是否应该清除选中状态（如果选中时间超过1分钟）
-                if self._current_option and self._select_time > 0:
-                    if current_time - self._select_time > 60:
-                        await self._clear_selected_option()
-                        
-            except Exception as err:
-                _LOGGER.error("Error updating task select: %s", err)
-        else:
-            _LOGGER.debug("Client not available for update")
+            # 如果当前选项不在新选项中，清除选中状态
+            if self._attr_current_option and self._attr_current_option not in self._attr_options:
+                self._clear_selected_option()
+            
+            # 记录更新状态
+            _LOGGER.debug("Task select updated with %d options", len(self._attr_options))
+        
+        # 检查是否应该清除选中状态（如果选中时间超过1分钟）
+        if self._attr_current_option and self._select_time > 0:
+            if time.monotonic_ns() - self._select_ns > SELECT_TIMEOUT_NS:
+                self._clear_selected_option()
+        
+        # 清除选中状态只修改属性，统一由下面的父类调用写入一次状态
+        self._update_attributes()
+        super()._handle_coordinator_update()
     
     async def async_will_remove_from_hass(self):
         """Run when entity will be removed from hass."""
@@ -268,45 +229,54 @@ class QingLongTaskSelect(SelectEntity):
             self._clear_select_timer.cancel()
         await super().async_will_remove_from_hass()
     
-    @property
-    def extra_state_attributes(self) -> dict[str, Any]:
-        """Return extra state attributes."""
-        attrs = {
-            "host": self._host,
-            "port": self._port,
-            "last_updated": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
-            "available_tasks": len(self._options),
-            "is_selected": self._current_option is not None,
-        }
+    def _fmt(self, ts: float) -> str:
+        """Format a timestamp, reusing recent results."""
+        formatted = self._fmt_cache.get(ts)
+        if formatted is None:
+            formatted = time.strftime(TIME_FMT, time.localtime(ts))
+            # 只保留最近的几个时间戳
+            if len(self._fmt_cache) >= 8:
+                self._fmt_cache.pop(next(iter(self._fmt_cache)))
+            self._fmt_cache[ts] = formatted
+        return formatted
+    
+    @callback
+    def _update_attributes(self) -> None:
+        """Rebuild extra state attributes; HA reads the cached dict."""
+        attrs: dict[str, Any] = self._base_attrs.copy()
+        attrs["last_updated"] = time.strftime(TIME_FMT, time.localtime())
+        attrs["available_tasks"] = len(self._attr_options)
+        attrs["is_selected"] = self._attr_current_option is not None
         
         # 添加选中时间信息
         if self._select_time > 0:
-            attrs["selected_since"] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self._select_time))
-            attrs["selected_seconds_ago"] = int(time.time() - self._select_time)
-            attrs["will_clear_in"] = max(0, 60 - (time.time() - self._select_time))
+            attrs["selected_since"] = self._fmt(self._select_time)
+            selected_for = (time.monotonic_ns() - self._select_ns) / 1_000_000_000
+            attrs["selected_seconds_ago"] = int(selected_for)
+            attrs["will_clear_in"] = max(0, 60 - selected_for)
         
         # 添加最近运行任务的状态
-        selected_task = self.hass.data[DOMAIN][self._entry.entry_id].get("selected_task")
-        if selected_task:
-            attrs["last_selected_task"] = selected_task["option"]
-            attrs["last_selected_time"] = time.strftime('%Y-%m-%d %H:%M:%S', 
-                                                       time.localtime(selected_task["timestamp"]))
+        selected_task: SelectedTask | None = self._entry_data.get("selected_task")
+        if selected_task is not None:
+            attrs["last_selected_task"] = selected_task.option
+            attrs["last_selected_time"] = self._fmt(selected_task.timestamp)
             
-            if "run_status" in selected_task:
-                run_status = selected_task["run_status"]
-                attrs["last_run_status"] = run_status["status"]
-                attrs["last_run_start"] = time.strftime('%Y-%m-%d %H:%M:%S', 
-                                                       time.localtime(run_status.get("start_time", 0)))
-                attrs["last_run_duration"] = f"{run_status.get('end_time', 0) - run_status.get('start_time', 0):.2f}秒"
-                if run_status.get("error"):
-                    attrs["last_run_error"] = run_status["error"]
+            run_status = selected_task.run_status
+            if run_status is not None:
+                attrs["last_run_status"] = run_status.status
+                attrs["last_run_start"] = self._fmt(run_status.start_time)
+                # 后台任务尚未返回时没有结束时间
+                if run_status.end_time:
+                    attrs["last_run_duration"] = f"{run_status.end_time - run_status.start_time:.2f}秒"
+                if run_status.error:
+                    attrs["last_run_error"] = run_status.error
         
-        if self._current_option and self._current_option in self._task_mapping:
-            task_info = self._task_mapping[self._current_option]
+        if self._attr_current_option and self._attr_current_option in self._task_mapping:
+            task_info = self._task_mapping[self._attr_current_option]
             attrs.update({
                 "task_id": task_info["task_id"],
                 "command": task_info["command"],
                 "task_name": task_info["name"],
             })
             
-        return attrs
+        self._attr_extra_state_attributes = attrs
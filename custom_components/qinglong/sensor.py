@@ -3,21 +3,21 @@
 from __future__ import annotations
 import logging
 import time
-from datetime import timedelta
 from typing import Any
 
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import (
+    CoordinatorEntity,
+    DataUpdateCoordinator,
+)
 
-from .const import DOMAIN
+from .const import DOMAIN, TIME_FMT, TOKEN_EXPIRY_BUFFER, TOKEN_REFRESH_THRESHOLD
 
 _LOGGER = logging.getLogger(__name__)
 
-# 轮询间隔 - 30秒
-SCAN_INTERVAL = timedelta(seconds=30)
-
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -27,33 +27,34 @@ async def async_setup_entry(
     """Set up QingLong sensors from a config entry."""
     
     data = hass.data[DOMAIN][entry.entry_id]
-    client = data.get("client")
-    host = data.get("host")
-    port = data.get("port")
-    tasks_data = data.get("tasks", {})
+    coordinator = data["coordinator"]
     
     # Create sensor entities
     sensors = [
-        QingLongTokenSensor(entry, client, host, port),
-        QingLongTasksSensor(entry, tasks_data, host, port),
+        QingLongTokenSensor(coordinator, entry, data),
+        QingLongTasksSensor(coordinator, entry, data),
     ]
     
-    async_add_entities(sensors, True)
+    async_add_entities(sensors)
 
 
-class QingLongTokenSensor(SensorEntity):
+class QingLongTokenSensor(CoordinatorEntity[DataUpdateCoordinator], SensorEntity):
     """Representation of a QingLong token sensor."""
     
-    # 设置轮询间隔
-    _attr_should_poll = True
+    __slots__ = ("_entry", "_client", "_host", "_port", "_last_refresh_display")
+    
+    # 由coordinator推送更新，无需单独轮询
+    _attr_should_poll = False
     
-    def __init__(self, entry: ConfigEntry, client, host: str, port: int):
+    def __init__(self, coordinator: DataUpdateCoordinator, entry: ConfigEntry,
+                 entry_data: dict[str, Any]):
         """Initialize the sensor."""
+        super().__init__(coordinator)
         self._entry = entry
-        self._client = client
-        self._host = host
-        self._port = port
-        self._last_update = 0
+        self._client = entry_data.get("client")
+        self._host = entry_data.get("host")
+        self._port = entry_data.get("port")
+        self._last_refresh_display: tuple[int, str] = (-1, "")  # (刷新时间戳, 格式化字符串)
         
         # Entity properties
         self._attr_name = "Token"
@@ -64,32 +65,35 @@ class QingLongTokenSensor(SensorEntity):
         self._update_state()
         
         # Device info
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, entry.entry_id)},
-            "name": f"青龙面板 ({host}:{port})",
-            "manufacturer": "青龙面板",
-            "model": "QingLong",
-        }
+        self._attr_device_info = entry_data["device_info"]
     
     def _update_state(self):
         """Update sensor state from client."""
-        if self._client:
-            token_info = self._client.get_token_info()
+        client = self._client
+        if client:
+            current_time = int(time.time())
+            expires_in = client.token_expires - current_time
             
             # 设置主值：显示完整的token字符串
-            self._attr_native_value = token_info["token"]
+            self._attr_native_value = client.token
+            
+            # 刷新时间只在token刷新后变化，缓存格式化结果
+            last_refresh_time = client.last_refresh_time
+            if self._last_refresh_display[0] != last_refresh_time:
+                display = time.strftime(TIME_FMT, time.localtime(last_refresh_time)) if last_refresh_time > 0 else "从未刷新"
+                self._last_refresh_display = (last_refresh_time, display)
             
             # 设置额外属性
             self._attr_extra_state_attributes = {
                 "host": self._host,
                 "port": self._port,
-                "token_expires_at": token_info["expires_at"],
-                "token_expires_in_seconds": token_info["expires_in"],
-                "token_expires_display": token_info["expires_display"],
-                "is_valid": token_info["is_valid"],
-                "needs_refresh": token_info["needs_refresh"],
-                "last_refresh_time": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(token_info["last_refresh_time"])) if token_info["last_refresh_time"] > 0 else "从未刷新",
-                "last_updated": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+                "token_expires_at": client.expires_at_display,
+                "token_expires_in_seconds": expires_in,
+                "token_expires_display": client.format_expires_in(expires_in),
+                "is_valid": expires_in > TOKEN_EXPIRY_BUFFER,
+                "needs_refresh": expires_in <= TOKEN_REFRESH_THRESHOLD,
+                "last_refresh_time": self._last_refresh_display[1],
+                "last_updated": time.strftime(TIME_FMT, time.localtime(current_time)),
             }
         else:
             self._attr_native_value = "客户端未初始化"
@@ -99,128 +103,56 @@ class QingLongTokenSensor(SensorEntity):
                 "connection_status": "disconnected",
             }
     
-    async def async_update(self) -> None:
-        """Update sensor state."""
-        current_time = time.time()
-        
-        # 检查是否需要更新（避免过于频繁的API调用）
-        if current_time - self._last_update < 30:
-            return
-            
-        # 触发客户端检查token是否需要刷新
-        if self._client:
-            await self._client._refresh_token_if_needed()
-            self._last_update = current_time
-            self._update_state()
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle updated data from the coordinator."""
+        # token的刷新已在coordinator拉取任务时完成
+        self._update_state()
+        super()._handle_coordinator_update()
 
 
-class QingLongTasksSensor(SensorEntity):
+class QingLongTasksSensor(CoordinatorEntity[DataUpdateCoordinator], SensorEntity):
     """Representation of a QingLong tasks sensor."""
     
-    # 设置轮询间隔
-    _attr_should_poll = True
+    __slots__ = ("_entry", "_host", "_port")
+    
+    # 由coordinator推送更新，无需单独轮询
+    _attr_should_poll = False
+    _attr_native_unit_of_measurement = "个"
     
-    def __init__(self, entry: ConfigEntry, tasks_data: Any, host: str, port: int):
+    def __init__(self, coordinator: DataUpdateCoordinator, entry: ConfigEntry,
+                 entry_data: dict[str, Any]):
         """Initialize the sensor."""
+        super().__init__(coordinator)
         self._entry = entry
-        self._tasks_data = tasks_data
-        self._host = host
-        self._port = port
-        self._last_update = 0
+        self._host = entry_data.get("host")
+        self._port = entry_data.get("port")
         
         # Entity properties
         self._attr_name = "定时任务"
         self._attr_unique_id = f"{DOMAIN}_{entry.entry_id}_tasks"
         self._attr_icon = "mdi:calendar-clock"
         
-        # Extract tasks list
-        tasks_list = self._extract_tasks_list(tasks_data)
-        
         # Sensor properties
-        self._attr_native_value = len(tasks_list)
-        self._attr_extra_state_attributes = self._get_tasks_attributes(tasks_list)
+        self._update_state()
         
         # Device info
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, entry.entry_id)},
-            "name": f"青龙面板 ({host}:{port})",
-            "manufacturer": "青龙面板",
-            "model": "QingLong",
-        }
+        self._attr_device_info = entry_data["device_info"]
     
-    def _extract_tasks_list(self, tasks_data: Any) -> list:
-        """Extract tasks list from tasks data."""
-        if isinstance(tasks_data, dict) and "data" in tasks_data:
-            inner_data = tasks_data["data"]
-            if isinstance(inner_data, dict) and "data" in inner_data:
-                # Structure: {"data": {"data": [...], "total": 2}}
-                return inner_data.get("data", [])
-            elif isinstance(inner_data, list):
-                # Direct list
-                return inner_data
-        
-        return []
-    
-    def _get_tasks_attributes(self, tasks_list: list) -> dict:
-        """Get tasks list attributes."""
-        attributes = {
-            "total_tasks": len(tasks_list),
-            "commands": [],
-            "enabled_tasks": 0,
-            "disabled_tasks": 0,
-            "last_updated": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+    def _update_state(self):
+        """Update sensor state from coordinator data."""
+        tasks = self.coordinator.data
+        self._attr_native_value = len(tasks.tasks_list) if tasks else 0
+        self._attr_extra_state_attributes = {
+            "total_tasks": self._attr_native_value,
+            "commands": tasks.commands if tasks else [],
+            "enabled_tasks": tasks.enabled_count if tasks else 0,
+            "disabled_tasks": tasks.disabled_count if tasks else 0,
+            "last_updated": time.strftime(TIME_FMT, time.localtime()),
         }
-        
-        for task in tasks_list:
-            if isinstance(task, dict):
-                # 添加command属性
-                command = task.get("command", "")
-                attributes["commands"].append(command)
-                
-                # 统计启用/禁用的任务
-                if task.get("isDisabled"):
-                    attributes["disabled_tasks"] += 1
-                else:
-                    attributes["enabled_tasks"] += 1
-        
-        return attributes
-    
-    @property
-    def native_value(self) -> int:
-        """Return number of tasks."""
-        tasks_list = self._extract_tasks_list(self._tasks_data)
-        return len(tasks_list)
     
-    @property
-    def native_unit_of_measurement(self) -> str:
-        """Return unit."""
-        return "个"
-    
-    async def async_update(self) -> None:
-        """Update tasks list."""
-        current_time = time.time()
-        
-        # 检查是否需要更新（避免过于频繁的API调用）
-        if current_time - self._last_update < 30:
-            return
-            
-        try:
-            data = self.hass.data[DOMAIN][self._entry.entry_id]
-            client = data.get("client")
-            
-            if client:
-                # Get latest tasks data
-                new_tasks_data = await client.async_get_tasks()
-                self._last_update = current_time
-                self._tasks_data = new_tasks_data
-                
-                # Update sensor value
-                tasks_list = self._extract_tasks_list(new_tasks_data)
-                self._attr_native_value = len(tasks_list)
-                self._attr_extra_state_attributes = self._get_tasks_attributes(tasks_list)
-                
-                # Update stored data
-                self.hass.data[DOMAIN][self._entry.entry_id]["tasks"] = new_tasks_data
-                
-        except Exception as err:
-            _LOGGER.error("Error updating tasks sensor: %s", err)
\ No newline at end of file
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle updated data from the coordinator."""
+        self._update_state()
+        super()._handle_coordinator_update()
\ No newline at end of file